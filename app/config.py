@@ -5,6 +5,14 @@ class Settings(BaseSettings):
     APP_NAME: str = "Code Fire Preventer"
     GOOGLE_API_KEY: str
     CHROMA_DB_DIR: str = "./chroma_db"
+    ARTIFACTS_DIR: str = "./artifacts"
+    BATCH_SIZE: int = 500
+    MAX_FILE_SIZE_KB: int = 500
+    ENABLE_LLM_CACHE: bool = True
+    LLM_CACHE_PATH: str = "./llm_cache.db"
+    LLM_CACHE_TTL_DAYS: int = 30
+    MIN_IMPACT_FOR_LLM: int = 1
+    RIPPLE_MAX_HOPS: int = 1
     
     class Config:
         env_file = ".env"
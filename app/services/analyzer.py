@@ -1,126 +1,351 @@
 import google.generativeai as genai
+import hashlib
 import json
+import orjson
+import pickle
 import networkx as nx
-from typing import Dict, List, Any, Optional
-from pydantic import BaseModel, Field
+from typing import Dict, List, Any, Optional, Tuple, Union
+from pydantic import TypeAdapter
 from app.config import get_settings
+from app.services.llm_cache import LLMCache, get_llm_cache
+from app.services.models import FileAnalysis
+from app.services.python_ast import AST_EXTRACTOR_VERSION, extract_python_files
 import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 settings = get_settings()
 
-# --- Pydantic Models for Structured Output ---
-class FunctionCall(BaseModel):
-    caller: str = Field(..., description="Name of the function making the call")
-    callee: str = Field(..., description="Name of the function or module being called")
+# Per-file content sent to the LLM, and how many files/characters are packed into one request
+MAX_LLM_FILE_CHARS = 15000
+LLM_BATCH_MAX_FILES = 20
+LLM_BATCH_MAX_CHARS = 100000
+LLM_MAX_CONCURRENCY = 8
+# Bytes of each changed file included in the impact-analysis context
+MAX_IMPACT_FILE_BYTES = 50000
+# Input token budget for the impact-analysis prompt (gemini-2.5-flash accepts ~1M), and the
+# characters-per-token ratio used to estimate it locally
+MAX_IMPACT_CONTEXT_TOKENS = 900000
+CHARS_PER_TOKEN = 4
+# Output cap for the impact report. On gemini-2.5-flash thinking tokens count against it too, so it
+# leaves room for thinking on large diffs; a tighter cap can end in MAX_TOKENS with no text at all.
+IMPACT_MAX_OUTPUT_TOKENS = 8192
 
-class FileAnalysis(BaseModel):
-    file_path: str
-    defined_functions: List[str] = Field(default_factory=list, description="List of functions defined in this file")
-    defined_classes: List[str] = Field(default_factory=list, description="List of classes defined in this file")
-    imports: List[str] = Field(default_factory=list, description="List of modules or files imported")
-    calls: List[FunctionCall] = Field(default_factory=list, description="List of function calls made within this file")
+# Recently loaded DiGraphs keyed by file path, reused while the file's mtime is unchanged.
+# Bounded LRU so graphs of repositories that are no longer queried aren't pinned in memory.
+GRAPH_CACHE_MAX_ENTRIES = 4
+_graph_cache: "OrderedDict[str, Tuple[int, nx.DiGraph]]" = OrderedDict()
+_graph_cache_lock = threading.Lock()
+
+# Validator for batched LLM responses, built once
+FILE_ANALYSIS_LIST = TypeAdapter(List[FileAnalysis])
+
+# Folded into cache keys so that changing the schema invalidates cached analyses
+FILE_ANALYSIS_SCHEMA_KEY = json.dumps(FileAnalysis.model_json_schema(), sort_keys=True)
+
+# --- Prompt Templates ---
+# The fixed instructions are sent as the model's system instruction, so every request starts with the
+# same static prefix and only the file contents vary at the end of the prompt
+DEPENDENCY_INSTRUCTIONS = """
+You analyze source code files and extract their dependencies.
+Each file is given as its file path followed by its code content.
+Report the analysis of every file given, with its file_path copied exactly as given.
+
+For each file extract:
+1. Defined functions and classes.
+2. Imports (modules or other files).
+3. Function calls (who calls whom).
+"""
+
+IMPACT_INSTRUCTIONS = """
+You analyze the impact of code changes, given the changed files and the affected functions.
+
+Predict:
+1. Potential risks (bugs, logic errors).
+2. Functional impact (what features might break).
+3. Suggested test cases.
+
+Return a concise markdown report.
+"""
+
+# Built once at import; only the per-call values are substituted
+DEPENDENCY_PROMPT = """File Path: {file_path}
+Code Content:
+```
+{content}
+```
+"""
+
+def _write_atomic(output_path: str, data: bytes):
+    """
+    Writes a file via a temporary file in the same directory and os.replace,
+    so concurrent readers see either the old file or the complete new one, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 class DependencyAnalyzer:
     def __init__(self):
         genai.configure(api_key=settings.GOOGLE_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # One model per system instruction, looked up by the instruction itself
+        self.models = {
+            instruction: genai.GenerativeModel('gemini-2.5-flash', system_instruction=instruction)
+            for instruction in (DEPENDENCY_INSTRUCTIONS, IMPACT_INSTRUCTIONS)
+        }
+        self.model = self.models[DEPENDENCY_INSTRUCTIONS]
 
-    def analyze_file_dependencies(self, file_path: str, content: str) -> Dict[str, Any]:
+    def _generate_content(self, prompt: str, system_instruction: str = DEPENDENCY_INSTRUCTIONS,
+                          use_cache: bool = True, **config) -> str:
         """
-        Uses GenAI to extract dependencies from a single file using structured output.
+        Calls the model configured with the given system instruction and returns the response text.
+        Identical (model, instruction, config, prompt) requests are served from the LLM cache when it is
+        enabled, unless use_cache is False (callers that cache the result in their own form).
         """
-        prompt = f"""
-        Analyze the following code file and extract its dependencies.
-        File Path: {file_path}
-        
-        Code Content:
-        ```
-        {content[:15000]} 
-        ```
+        model = self.models[system_instruction]
+        cache = get_llm_cache() if use_cache else None
+        if cache:
+            # Key on the schema itself, so changing FileAnalysis invalidates old entries
+            key_params = {
+                name: json.dumps(TypeAdapter(value).json_schema(), sort_keys=True) if name == 'response_schema' else value
+                for name, value in config.items()
+            }
+            key = cache.make_key(
+                model.model_name, prompt, system_instruction=system_instruction, **key_params
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.GenerationConfig(**config)
+        )
+        text = response.text
         
-        Extract:
-        1. Defined functions and classes.
-        2. Imports (modules or other files).
-        3. Function calls (who calls whom).
+        if cache:
+            cache.set(key, text)
+        return text
+
+    def analyze_files_batch(self, files: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Extracts dependencies for many (file_path, content) pairs.
+        Python files are parsed locally; everything else is packed into as few LLM requests as possible.
+        Results are returned in the input order.
         """
+        results = {}
+        python_files = [(file_path, content) for file_path, content in files if file_path.endswith('.py')]
+        for (file_path, _), analysis in zip(python_files, extract_python_files(python_files)):
+            if analysis is not None:
+                results[file_path] = analysis
+        # Everything else, including Python that failed to parse, goes to the LLM
+        pending = [
+            (file_path, content[:MAX_LLM_FILE_CHARS]) for file_path, content in files if file_path not in results
+        ]
+
+        # Files whose content hasn't changed since a previous run are answered from the cache,
+        # so an edit to one file doesn't re-send every other file that shared its batch
+        cache = get_llm_cache()
+        file_keys = {}
+        if cache:
+            uncached = []
+            for file_path, content in pending:
+                file_keys[file_path] = self._file_analysis_key(file_path, content)
+                cached = cache.get(file_keys[file_path])
+                if cached is not None:
+                    results[file_path] = orjson.loads(cached)
+                else:
+                    uncached.append((file_path, content))
+            pending = uncached
+
+        # Batches are independent, so overlap their round-trips (bounded to stay within rate limits)
+        batches = self._pack_batches(pending)
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(LLM_MAX_CONCURRENCY, len(batches))) as pool:
+                for analyses in pool.map(self._analyze_batch_with_llm, batches):
+                    results.update(analyses)
+                    if cache:
+                        for file_path, analysis in analyses.items():
+                            cache.set(file_keys[file_path], orjson.dumps(analysis).decode())
+
+        return [results.get(file_path) or FileAnalysis(file_path=file_path).model_dump() for file_path, _ in files]
+
+    def analyze_files_incremental(self, files: List[Tuple[str, str]], index_path: str) -> List[Dict[str, Any]]:
+        """
+        Same as analyze_files_batch, but reuses the analyses recorded in index_path for files whose
+        content hash is unchanged since the last run, then rewrites the index.
+        """
+        previous = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'rb') as f:
+                    index = orjson.loads(f.read())
+                # Analyses recorded under a different schema or extractor version are all stale
+                if index.get('schema') == FILE_ANALYSIS_SCHEMA_KEY and index.get('extractor') == AST_EXTRACTOR_VERSION:
+                    previous = index.get('files', {})
+            except Exception as e:
+                print(f"Ignoring unreadable analysis index {index_path}: {e}")
+
+        hashes = {file_path: hashlib.sha256(content.encode('utf-8')).hexdigest() for file_path, content in files}
+        results = {}
+        changed = []
+        for file_path, content in files:
+            entry = previous.get(file_path)
+            if entry and entry.get('hash') == hashes[file_path]:
+                results[file_path] = entry['analysis']
+            else:
+                changed.append((file_path, content))
+
+        print(f"Reusing {len(results)} unchanged file analyses, analyzing {len(changed)} files.")
+        for analysis in self.analyze_files_batch(changed):
+            results[analysis['file_path']] = analysis
+
+        # Empty analyses aren't recorded, so files whose LLM call failed are retried on the next run
+        index = {
+            'schema': FILE_ANALYSIS_SCHEMA_KEY,
+            'extractor': AST_EXTRACTOR_VERSION,
+            'files': {
+                file_path: {'hash': hashes[file_path], 'analysis': analysis}
+                for file_path, analysis in results.items()
+                if any(value for key, value in analysis.items() if key != 'file_path')
+            }
+        }
+        try:
+            with open(index_path, 'wb') as f:
+                f.write(orjson.dumps(index))
+        except Exception as e:
+            print(f"Failed to save analysis index {index_path}: {e}")
+
+        return [results[file_path] for file_path, _ in files]
+
+    def _file_analysis_key(self, file_path: str, content: str) -> str:
+        """Cache key for one file's dependency analysis, stable for as long as the file is unchanged."""
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return LLMCache.make_key(
+            self.model.model_name, content_hash, file_path=file_path,
+            system_instruction=DEPENDENCY_INSTRUCTIONS, schema=FILE_ANALYSIS_SCHEMA_KEY
+        )
+
+    def _pack_batches(self, files: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        """Greedily groups files into batches bounded by LLM_BATCH_MAX_FILES and LLM_BATCH_MAX_CHARS."""
+        batches = []
+        current = []
+        current_size = 0
+        for file_path, content in files:
+            if current and (len(current) >= LLM_BATCH_MAX_FILES or current_size + len(content) > LLM_BATCH_MAX_CHARS):
+                batches.append(current)
+                current = []
+                current_size = 0
+            current.append((file_path, content))
+            current_size += len(content)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _analyze_batch_with_llm(self, batch: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+        """Analyzes a batch of files with a single structured-output request, keyed by file path."""
+        prompt = "\n".join(
+            DEPENDENCY_PROMPT.format(file_path=file_path, content=content) for file_path, content in batch
+        )
         
         try:
-            # Use generation_config for JSON schema enforcement (if supported by lib version)
-            # Or just rely on the model's ability to follow the Pydantic schema in prompt
-            # For robustness with 2.5-flash, we can use response_schema if available, 
-            # but let's stick to a strong prompt + Pydantic validation for now to be safe across versions.
-            
-            response = self.model.generate_content(
+            # Cached per file by analyze_files_batch instead: a batch prompt is never repeated once
+            # its files are cached individually, so caching it too would only store everything twice
+            response_text = self._generate_content(
                 prompt,
-                generation_config=genai.GenerationConfig(
-                    response_mime_type="application/json",
-                    response_schema=FileAnalysis
-                )
+                use_cache=False,
+                response_mime_type="application/json",
+                response_schema=list[FileAnalysis]
             )
             
-            # Parse JSON
-            analysis_data = json.loads(response.text)
-            # Ensure file_path is set correctly (model might hallucinate it)
-            analysis_data['file_path'] = file_path
-            
-            # Validate with Pydantic
-            analysis = FileAnalysis(**analysis_data)
-            return analysis.model_dump()
+            requested = {file_path for file_path, _ in batch}
+            analyses = {}
+            # Parse and validate the whole response in one pass
+            for analysis in FILE_ANALYSIS_LIST.validate_json(response_text):
+                # Drop entries for paths the model made up
+                if analysis.file_path in requested:
+                    analyses[analysis.file_path] = analysis.model_dump()
+            return analyses
             
         except Exception as e:
-            print(f"Error analyzing {file_path}: {e}")
-            return FileAnalysis(file_path=file_path).model_dump()
+            print(f"Error analyzing batch of {len(batch)} files: {e}")
+            return {}
 
     def resolve_imports(self, file_analyses: List[Dict[str, Any]]) -> Dict[str, str]:
         """
         Creates a mapping of 'module_name' -> 'file_path' to help link imports.
+        Every dotted suffix of a file's path below the common root is mapped
+        (e.g. "app.services.utils", "services.utils" and "utils"), so an import resolves with one lookup.
         This is a heuristic approach.
         """
+        paths = [analysis['file_path'] for analysis in file_analyses]
+        if not paths:
+            return {}
+        root = os.path.commonpath(paths) if len(paths) > 1 else os.path.dirname(paths[0])
+        
         module_map = {}
-        for analysis in file_analyses:
-            path = analysis['file_path']
-            # Heuristic: filename without extension is often the module name
-            basename = os.path.basename(path)
-            module_name = os.path.splitext(basename)[0]
-            module_map[module_name] = path
-            
-            # Also map the full path relative to repo root if possible (complex logic omitted for brevity)
+        for path in paths:
+            parts = os.path.splitext(os.path.relpath(path, root))[0].split(os.sep)
+            # A package's __init__ is imported by the package name
+            if len(parts) > 1 and parts[-1] == '__init__':
+                parts.pop()
+            for i in range(len(parts)):
+                module_map['.'.join(parts[i:])] = path
         return module_map
 
     def build_dependency_graph(self, file_analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
-        Constructs a graph from the analysis results with symbol resolution.
+        Constructs a graph from the analysis results with symbol resolution, in node-link format.
+        """
+        return nx.node_link_data(self.build_dependency_digraph(file_analyses))
+
+    def build_dependency_digraph(self, file_analyses: List[Dict[str, Any]]) -> nx.DiGraph:
+        """
+        Constructs the dependency graph as a DiGraph.
         """
-        G = nx.DiGraph()
         module_map = self.resolve_imports(file_analyses)
+        # Collected first and added in bulk, rather than one add_node/add_edge call per item
+        nodes = []
+        edges = []
         
         for analysis in file_analyses:
             file_node = analysis['file_path']
-            G.add_node(file_node, type='file')
+            nodes.append((file_node, {'type': 'file'}))
+            # Set for O(1) membership checks when resolving calls below
+            defined_functions = set(analysis.get('defined_functions', []))
             
             # Add functions
             for func in analysis.get('defined_functions', []):
                 func_node = f"{file_node}::{func}"
-                G.add_node(func_node, type='function')
-                G.add_edge(file_node, func_node, relation='defines')
+                nodes.append((func_node, {'type': 'function'}))
+                edges.append((file_node, func_node, {'relation': 'defines'}))
             
             # Add imports (File -> File dependencies)
-            for imp in analysis.get('imports', []):
-                # Try to resolve import to a file
-                # 1. Direct match (e.g., "utils" -> "utils.py")
+            imports = analysis.get('imports', [])
+            imported = set(imports)
+            for imp in imports:
+                # Try to resolve import to a file: the full dotted name (e.g. "app.services.utils")
                 resolved_path = module_map.get(imp)
-                if not resolved_path:
-                    # 2. Try splitting (e.g., "app.services.utils" -> "utils")
-                    parts = imp.split('.')
-                    if parts[-1] in module_map:
-                        resolved_path = module_map[parts[-1]]
+                if not resolved_path and '.' in imp and imp.rsplit('.', 1)[0] in imported:
+                    # "pkg.name" recorded alongside "pkg" for "from pkg import name": an edge only
+                    # if it names a module, otherwise it is a function/class already covered by "pkg"
+                    continue
+                # Otherwise fall back to its last component (e.g. "utils") for imports relative to another root
+                resolved_path = resolved_path or module_map.get(imp.rsplit('.', 1)[-1])
                 
                 if resolved_path:
-                    G.add_edge(file_node, resolved_path, relation='imports')
+                    edges.append((file_node, resolved_path, {'relation': 'imports'}))
                 else:
                     # External dependency or unresolved
-                    G.add_node(imp, type='external_module')
-                    G.add_edge(file_node, imp, relation='imports')
+                    nodes.append((imp, {'type': 'external_module'}))
+                    edges.append((file_node, imp, {'relation': 'imports'}))
 
             # Add calls (Function -> Function/Module)
             for call in analysis.get('calls', []):
@@ -131,44 +356,85 @@ class DependencyAnalyzer:
                 
                 # Try to resolve callee
                 # If callee is "other_func", check if it's in this file
-                if callee_name in analysis.get('defined_functions', []):
+                if callee_name in defined_functions:
                     callee_node = f"{file_node}::{callee_name}"
-                    G.add_edge(caller_node, callee_node, relation='calls')
+                    edges.append((caller_node, callee_node, {'relation': 'calls'}))
                 else:
                     # Check if it's "module.func"
                     if '.' in callee_name:
-                        mod, func = callee_name.split('.', 1)
+                        mod, func = callee_name.rsplit('.', 1)
                         if mod in module_map:
                             target_file = module_map[mod]
                             # We assume the function exists there (optimistic linking)
                             callee_node = f"{target_file}::{func}"
-                            G.add_edge(caller_node, callee_node, relation='calls')
+                            edges.append((caller_node, callee_node, {'relation': 'calls'}))
                         else:
                             # External call
-                            G.add_edge(caller_node, callee_name, relation='calls')
+                            edges.append((caller_node, callee_name, {'relation': 'calls'}))
                     else:
                         # Unresolved local or global
-                        G.add_edge(caller_node, callee_name, relation='calls')
+                        edges.append((caller_node, callee_name, {'relation': 'calls'}))
 
-        return nx.node_link_data(G)
+        G = nx.DiGraph()
+        G.add_nodes_from(nodes)
+        G.add_edges_from(edges)
+        return G
 
     def save_graph(self, graph_data: Dict[str, Any], output_path: str):
         """Saves the graph to a JSON file."""
-        with open(output_path, 'w') as f:
-            json.dump(graph_data, f, indent=2)
+        _write_atomic(output_path, orjson.dumps(graph_data, option=orjson.OPT_INDENT_2))
+
+    def save_graph_fast(self, G: nx.DiGraph, output_path: str):
+        """
+        Pickles the graph for internal reuse. Loading it skips JSON parsing and the node-link rebuild;
+        the JSON from save_graph remains the export format.
+        """
+        _write_atomic(output_path, pickle.dumps(G, protocol=pickle.HIGHEST_PROTOCOL))
 
     def load_graph(self, input_path: str) -> Dict[str, Any]:
         """Loads the graph from a JSON file."""
         if not os.path.exists(input_path):
             return None
-        with open(input_path, 'r') as f:
-            return json.load(f)
+        with open(input_path, 'rb') as f:
+            return orjson.loads(f.read())
 
-    def analyze_impact(self, diff_data: List[Dict[str, Any]], graph_data: Dict[str, Any], vector_store, repo_path: str) -> Dict[str, Any]:
+    def load_graph_fast(self, input_path: str) -> Optional[nx.DiGraph]:
+        """Loads a graph written by save_graph_fast, memoized on the file's mtime."""
+        if not os.path.exists(input_path):
+            return None
+        mtime = os.stat(input_path).st_mtime_ns
+        with _graph_cache_lock:
+            cached = _graph_cache.get(input_path)
+            if cached and cached[0] == mtime:
+                _graph_cache.move_to_end(input_path)
+                return cached[1]
+        with open(input_path, 'rb') as f:
+            graph = pickle.loads(f.read())
+        with _graph_cache_lock:
+            _graph_cache[input_path] = (mtime, graph)
+            _graph_cache.move_to_end(input_path)
+            while len(_graph_cache) > GRAPH_CACHE_MAX_ENTRIES:
+                _graph_cache.popitem(last=False)
+        return graph
+
+    def _read_changed_file(self, full_path: str) -> Optional[str]:
+        """Reads the head of a changed file for the impact context. Returns None if it is missing or unreadable."""
+        try:
+            if not os.path.exists(full_path):
+                return None
+            # Only the head of a large file fits in the prompt, so don't read the rest
+            with open(full_path, 'rb') as f:
+                return f.read(MAX_IMPACT_FILE_BYTES).decode('utf-8', errors='ignore')
+        except Exception as e:
+            print(f"Could not read file {full_path}: {e}")
+            return None
+
+    def analyze_impact(self, diff_data: List[Dict[str, Any]], graph_data: Union[nx.DiGraph, Dict[str, Any]], vector_store, repo_path: str) -> Dict[str, Any]:
         """
         Analyzes the impact of changes based on the diff and dependency graph.
+        The graph may be a DiGraph (preferred, used as is) or node-link data. It is only read, never modified.
         """
-        G = nx.node_link_graph(graph_data)
+        G = graph_data if isinstance(graph_data, nx.DiGraph) else nx.node_link_graph(graph_data)
         affected_nodes = set()
         impact_report = {
             "direct_impact": [],
@@ -186,79 +452,112 @@ class DependencyAnalyzer:
             full_path = os.path.join(repo_path, relative_path)
             
             # Find nodes in G that match this file
-            # G nodes are absolute paths
-            file_nodes = [n for n in G.nodes if str(n).startswith(full_path)]
+            # G nodes are absolute paths; a file's functions are linked from its node by 'defines' edges,
+            # so this is a lookup on the file node instead of a scan over the whole graph
+            if full_path not in G:
+                continue
             
-            for node in file_nodes:
-                if G.nodes[node].get('type') == 'function':
+            for node, edge_data in G.adj[full_path].items():
+                if edge_data.get('relation') == 'defines' and G.nodes[node].get('type') == 'function':
                     affected_nodes.add(node)
                     impact_report["direct_impact"].append(node)
 
+        # Nothing at function level changed (comments, config, non-code files): there is
+        # neither a ripple to walk nor anything for the LLM to assess
+        if not affected_nodes:
+            impact_report["risk_analysis"] = "No function-level changes detected."
+            return impact_report
+
         # 2. Find Ripple Effect
+        # A single breadth-first pass backwards over 'calls' edges from all changed functions at once,
+        # up to RIPPLE_MAX_HOPS levels of callers; every node is expanded at most once
         ripple_nodes = set()
-        for node in affected_nodes:
-            predecessors = G.predecessors(node)
-            for pred in predecessors:
-                edge_data = G.get_edge_data(pred, node)
-                if edge_data.get('relation') == 'calls':
-                    ripple_nodes.add(pred)
-                    impact_report["ripple_effect"].append(pred)
+        frontier = impact_report["direct_impact"]
+        for _ in range(settings.RIPPLE_MAX_HOPS):
+            next_frontier = []
+            for node in frontier:
+                for pred, edge_data in G.pred[node].items():
+                    # Callers that were changed themselves are already in direct_impact
+                    if pred in affected_nodes or pred in ripple_nodes:
+                        continue
+                    if edge_data.get('relation') == 'calls':
+                        ripple_nodes.add(pred)
+                        impact_report["ripple_effect"].append(pred)
+                        next_frontier.append(pred)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+
+        # Low-impact changes don't justify a full LLM round-trip
+        impact_score = len(affected_nodes) + len(ripple_nodes)
+        if impact_score < settings.MIN_IMPACT_FOR_LLM:
+            impact_report["risk_analysis"] = (
+                f"Skipped AI risk analysis: impact score {impact_score} is below the "
+                f"threshold of {settings.MIN_IMPACT_FOR_LLM} affected functions."
+            )
+            return impact_report
 
         # 3. LLM Risk Analysis
         # Fetch code for affected and ripple nodes
-        context = "Changed Files Content:\n"
+        # Built from the ordered lists, not the affected_nodes set: set order varies with the hash seed,
+        # and the prompt has to be identical across restarts for the LLM cache to hit
+        direct_targets = [tuple(node.split("::", 1)) for node in dict.fromkeys(impact_report["direct_impact"]) if "::" in node]
+        ripple_targets = [tuple(node.split("::", 1)) for node in impact_report["ripple_effect"][:5] if "::" in node] # Limit to 5 to avoid context overflow
         
-        # Add full content of changed files to context
-        for change in diff_data:
-            try:
-                full_path = os.path.join(repo_path, change['file_path'])
-                if os.path.exists(full_path):
-                    with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                    context += f"File: {change['file_path']}\n```\n{content}\n```\n---\n"
-            except Exception as e:
-                print(f"Could not read file {change['file_path']}: {e}")
-
-        context += "\nAffected Functions (Directly Changed):\n"
-        for node in list(affected_nodes):
-            if "::" in node:
-                fname = node.split("::")[1]
-                fpath = node.split("::")[0]
-                code = vector_store.get_function_chunk(fpath, fname)
-                context += f"Function {fname} in {fpath}:\n{code}\n---\n"
+        # Fetch all function chunks in one vector store round-trip
+        function_chunks = vector_store.get_function_chunks(direct_targets + ripple_targets)
+
+        functions_context = "\nAffected Functions (Directly Changed):\n"
+        for fpath, fname in direct_targets:
+            code = function_chunks.get((fpath, fname), "")
+            functions_context += f"Function {fname} in {fpath}:\n{code}\n---\n"
                 
-        context += "\nAffected Callers (Ripple Effect):\n"
-        for node in list(ripple_nodes)[:5]: # Limit to 5 to avoid context overflow
-            if "::" in node:
-                fname = node.split("::")[1]
-                fpath = node.split("::")[0]
-                code = vector_store.get_function_chunk(fpath, fname)
-                context += f"Function {fname} in {fpath}:\n{code}\n---\n"
+        functions_context += "\nAffected Callers (Ripple Effect):\n"
+        for fpath, fname in ripple_targets:
+            code = function_chunks.get((fpath, fname), "")
+            functions_context += f"Function {fname} in {fpath}:\n{code}\n---\n"
 
-        print(f"\nContext Length: {len(context)}")
-        
-        prompt = f"""
-        Analyze the impact of the following code changes.
-        
-        {context}
-        
-        Predict:
-        1. Potential risks (bugs, logic errors).
-        2. Functional impact (what features might break).
-        3. Suggested test cases.
+        # The function sections are always sent; changed files fill the remaining token budget,
+        # those with the most affected functions first. Tokens are estimated from characters
+        # since count_tokens is a remote call.
+        budget = MAX_IMPACT_CONTEXT_TOKENS * CHARS_PER_TOKEN - len(functions_context)
+        affected_per_file = Counter(fpath for fpath, _ in direct_targets)
+        changed_files = sorted(
+            diff_data,
+            key=lambda change: affected_per_file[os.path.join(repo_path, change['file_path'])],
+            reverse=True
+        )
+
+        context = "Changed Files Content:\n"
         
-        Return a concise markdown report.
-        """
+        # Add full content of changed files to context. The reads are independent, so they run
+        # concurrently; map() keeps the ranking order.
+        with ThreadPoolExecutor() as pool:
+            contents = pool.map(self._read_changed_file, [os.path.join(repo_path, c['file_path']) for c in changed_files])
+            for change, content in zip(changed_files, contents):
+                if content is None:
+                    continue
+                section = f"File: {change['file_path']}\n```\n{content}\n```\n---\n"
+                if len(section) > budget:
+                    print(f"Leaving {change['file_path']} out of the context: over the token budget")
+                    continue
+                context += section
+                budget -= len(section)
+
+        context += functions_context
+
+        print(f"\nContext Length: {len(context)}")
         
         try:
-            # Use lower temperature for more deterministic results
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.GenerationConfig(
-                    temperature=0.2
-                )
+            # Deterministic, single-candidate and length-capped: the report is meant to be concise,
+            # and identical inputs then give identical (cacheable) outputs
+            impact_report["risk_analysis"] = self._generate_content(
+                context,
+                system_instruction=IMPACT_INSTRUCTIONS,
+                temperature=0.0,
+                max_output_tokens=IMPACT_MAX_OUTPUT_TOKENS,
+                candidate_count=1
             )
-            impact_report["risk_analysis"] = response.text
         except Exception as e:
             impact_report["risk_analysis"] = f"Failed to generate analysis: {e}"
             
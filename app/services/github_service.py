@@ -2,6 +2,12 @@ import requests
 import re
 from typing import List, Dict, Any, Tuple
 
+# Regex to match chunk headers: @@ -old_start,old_len +new_start,new_len @@
+CHUNK_HEADER_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+# Shared across GitHubService instances so connections to the API are kept alive between requests
+_session = requests.Session()
+
 class GitHubService:
     def __init__(self, token: str = None):
         self.token = token
@@ -27,7 +33,7 @@ class GitHubService:
             
         api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_sha}"
         
-        response = requests.get(api_url, headers=self.headers)
+        response = _session.get(api_url, headers=self.headers)
         if response.status_code != 200:
             raise Exception(f"Failed to fetch commit: {response.status_code} {response.text}")
             
@@ -59,16 +65,13 @@ class GitHubService:
         Returns a list of line numbers in the new file version.
         """
         changed_lines = []
-        # Regex to match chunk headers: @@ -old_start,old_len +new_start,new_len @@
-        chunk_header_re = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
-        
         current_line_number = 0
         
         lines = patch.split('\n')
         
         for line in lines:
             if line.startswith('@@'):
-                match = chunk_header_re.match(line)
+                match = CHUNK_HEADER_RE.match(line)
                 if match:
                     start_line = int(match.group(1))
                     current_line_number = start_line
@@ -0,0 +1,95 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import time
+from functools import lru_cache
+from typing import Optional
+from app.config import get_settings
+
+settings = get_settings()
+
+class LLMCache:
+    """
+    Persistent cache of LLM responses, keyed by a hash of the model, generation parameters and prompt.
+    Backed by a single SQLite file so cached answers survive restarts; entries expire after ttl_seconds.
+    The most recently used entries are also kept in memory, so hot keys skip the database.
+    """
+    def __init__(self, path: str, ttl_seconds: float, memory_size: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        # key -> (created_at, response), in least- to most-recently-used order
+        self.memory: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Keys for old file contents and prompts are never read again, so expiry on read alone
+            # would let the file grow forever; purge everything past the TTL on open
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - ttl_seconds,))
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, **params) -> str:
+        """Builds a stable cache key from the model name, generation parameters and prompt."""
+        parts = [model] + [f"{name}={params[name]}" for name in sorted(params)] + [prompt]
+        return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response, or None if it is missing or older than the TTL."""
+        oldest = time.time() - self.ttl_seconds
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                entry = self.conn.execute(
+                    "SELECT created_at, response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            
+            if entry and entry[0] >= oldest:
+                self._remember(key, entry)
+                self.hits += 1
+                return entry[1]
+            
+            if entry:
+                # Expired: drop it rather than letting it take a slot from a live entry
+                self.memory.pop(key, None)
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+    def stats(self) -> str:
+        """One-line summary of cache effectiveness since startup, for logging."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups if lookups else 0.0
+            return f"LLM cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
+
+    def set(self, key: str, response: str):
+        created_at = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, created_at)
+            )
+            self.conn.commit()
+            self._remember(key, (created_at, response))
+
+    def _remember(self, key: str, entry):
+        """Adds an entry to the in-memory LRU, evicting the least recently used one when full."""
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+@lru_cache()
+def get_llm_cache() -> Optional[LLMCache]:
+    """Returns the process-wide LLM cache, or None when caching is disabled."""
+    if not settings.ENABLE_LLM_CACHE:
+        return None
+    return LLMCache(settings.LLM_CACHE_PATH, ttl_seconds=settings.LLM_CACHE_TTL_DAYS * 86400)
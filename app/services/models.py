@@ -0,0 +1,14 @@
+from typing import List
+from pydantic import BaseModel, Field
+
+# --- Pydantic Models for Structured Output ---
+class FunctionCall(BaseModel):
+    caller: str = Field(..., description="Name of the function making the call")
+    callee: str = Field(..., description="Name of the function or module being called")
+
+class FileAnalysis(BaseModel):
+    file_path: str
+    defined_functions: List[str] = Field(default_factory=list, description="List of functions defined in this file")
+    defined_classes: List[str] = Field(default_factory=list, description="List of classes defined in this file")
+    imports: List[str] = Field(default_factory=list, description="List of modules or files imported")
+    calls: List[FunctionCall] = Field(default_factory=list, description="List of function calls made within this file")
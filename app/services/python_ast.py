@@ -0,0 +1,118 @@
+import ast
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
+from app.services.models import FunctionCall, FileAnalysis
+
+# Below this many Python files, AST extraction runs in-process
+PARALLEL_AST_MIN_FILES = 64
+
+# --- AST-based Extraction for Python Files ---
+# Bumped whenever the extraction output changes, so analyses recorded by older versions are redone
+AST_EXTRACTOR_VERSION = 2
+
+def _callee_name(func: ast.expr) -> Optional[str]:
+    """
+    Renders the target of a call as a dotted name (e.g. "utils.helper").
+    Calls on self/cls are reduced to the method name so they resolve to functions in the same file.
+    """
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if not isinstance(func, ast.Name):
+        # Calls on call results, subscripts, etc. have no static name
+        return None
+    if func.id in ('self', 'cls') and len(parts) == 1:
+        return parts[0]
+    parts.append(func.id)
+    return '.'.join(reversed(parts))
+
+class _PythonDependencyVisitor(ast.NodeVisitor):
+    """Collects definitions, imports and caller -> callee pairs in a single pass over a module."""
+
+    def __init__(self):
+        self.functions: List[str] = []
+        self.classes: List[str] = []
+        self.imports: List[str] = []
+        self.calls: List[Dict[str, str]] = []
+        # Names of the enclosing functions; calls are attributed to the innermost one
+        self._scope: List[str] = []
+
+    def visit_FunctionDef(self, node):
+        self.functions.append(node.name)
+        self._scope.append(node.name)
+        self.generic_visit(node)
+        self._scope.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self.classes.append(node.name)
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append(alias.name)
+
+    def visit_ImportFrom(self, node):
+        if node.module:
+            self.imports.append(node.module)
+            # "from pkg import mod" may import a submodule; build_dependency_graph keeps
+            # "pkg.mod" only if it resolves to a file
+            self.imports.extend(f"{node.module}.{alias.name}" for alias in node.names if alias.name != '*')
+        else:
+            # "from . import utils" imports sibling modules by name
+            self.imports.extend(alias.name for alias in node.names)
+
+    def visit_Call(self, node):
+        callee = _callee_name(node.func)
+        # Module-level calls have no caller function to hang an edge from
+        if callee and self._scope:
+            self.calls.append({"caller": self._scope[-1], "callee": callee})
+        self.generic_visit(node)
+
+def extract_python_dependencies(file_path: str, content: str) -> Dict[str, Any]:
+    """
+    Extracts dependencies from Python source with the ast module instead of the LLM.
+    Raises SyntaxError/ValueError if the source can't be parsed, and RecursionError/MemoryError
+    if it is valid but too deeply nested for the parser or visitor (e.g. long generated "+" chains).
+    """
+    visitor = _PythonDependencyVisitor()
+    visitor.visit(ast.parse(content, filename=file_path))
+    return FileAnalysis(
+        file_path=file_path,
+        defined_functions=list(dict.fromkeys(visitor.functions)),
+        defined_classes=list(dict.fromkeys(visitor.classes)),
+        imports=list(dict.fromkeys(visitor.imports)),
+        calls=[FunctionCall(**call) for call in visitor.calls]
+    ).model_dump()
+
+def _extract_python_or_none(item: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+    """Process-pool worker: AST extraction for one (file_path, content) pair, or None if it doesn't parse."""
+    file_path, content = item
+    try:
+        return extract_python_dependencies(file_path, content)
+    except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+        print(f"AST parse failed for {file_path}: {e}, falling back to LLM.")
+        return None
+
+def extract_python_files(files: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Runs AST extraction over many Python files, in input order.
+    Parsing is CPU-bound, so large sets are spread across processes; small ones aren't worth the startup cost.
+    """
+    if len(files) < PARALLEL_AST_MIN_FILES:
+        return [_extract_python_or_none(item) for item in files]
+    return list(_get_process_pool().map(_extract_python_or_none, files, chunksize=16))
+
+@lru_cache()
+def _get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool for AST extraction, created on first use and reused afterwards.
+    Workers are spawned rather than forked: the server process already runs gRPC, Chroma and tokenizer
+    threads, and forking it could leave children deadlocked on locks held by those threads.
+    Spawned workers only import this module, which needs neither settings nor the Gemini client.
+    """
+    return ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
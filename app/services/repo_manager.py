@@ -1,8 +1,33 @@
+import hashlib
 import os
+import re
 import shutil
 import tempfile
 from typing import List
 from git import Repo
+from app.config import get_settings
+
+settings = get_settings()
+
+# Extensions of files considered for analysis. Add more as needed
+CODE_EXTENSIONS = frozenset({'.py', '.js', '.ts', '.java', '.cpp', '.c', '.h', '.go', '.rs', '.rb', '.php'})
+
+# Full SHA-1 or SHA-256 object names
+FULL_SHA_RE = re.compile(r'[0-9a-fA-F]{40}|[0-9a-fA-F]{64}')
+
+def get_artifacts_dir(repo_url: str) -> str:
+    """
+    Returns the server-owned directory for a repository's derived artifacts (graph, analysis index).
+    It lives outside the clone on purpose: anything inside the checkout is controlled by the
+    repository's author, so nothing derived is ever read back from there.
+    """
+    normalized = repo_url.strip().rstrip('/')
+    if normalized.endswith('.git'):
+        normalized = normalized[:-4]
+    repo_name = normalized.split('/')[-1]
+    # The URL hash keeps same-named repositories from different owners apart
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.abspath(settings.ARTIFACTS_DIR), f"{repo_name}-{digest}")
 
 class RepoManager:
     def __init__(self):
@@ -29,11 +54,14 @@ class RepoManager:
             
             if os.path.exists(self.temp_dir):
                 # Repo exists, fetch latest to ensure we have the commit
+                # (skipped when the requested commit is already in the local clone)
                 repo = Repo(self.temp_dir)
-                repo.remotes.origin.fetch()
+                if not (commit_sha and self._has_commit(repo, commit_sha)):
+                    repo.remotes.origin.fetch()
             else:
-                # Clone fresh
-                repo = Repo.clone_from(repo_url, self.temp_dir)
+                # Clone fresh. A blobless partial clone keeps the full commit history for checkouts
+                # but only downloads file contents as they are needed.
+                repo = Repo.clone_from(repo_url, self.temp_dir, multi_options=['--filter=blob:none'])
             
             # Checkout specific commit if requested
             if commit_sha:
@@ -54,19 +82,38 @@ class RepoManager:
         except Exception as e:
             raise Exception(f"Failed to clone/checkout repository: {str(e)}")
 
+    def _has_commit(self, repo: Repo, commit_sha: str) -> bool:
+        """
+        Checks whether a commit is already present in the local clone.
+        Only full hex SHAs qualify: branch and tag names (and short SHAs) also resolve locally,
+        but may point somewhere else on the remote, so those always fetch.
+        """
+        if not FULL_SHA_RE.fullmatch(commit_sha):
+            return False
+        try:
+            repo.commit(commit_sha)
+            return True
+        except Exception:
+            return False
+
     def get_files(self, repo_path: str) -> List[str]:
         """Traverses the repo and returns a list of relevant file paths."""
         relevant_files = []
-        # Add more extensions as needed
-        valid_extensions = {'.py', '.js', '.ts', '.java', '.cpp', '.c', '.h', '.go', '.rs', '.rb', '.php'}
+        # Oversized files (vendored bundles, minified or generated code) are skipped before anything reads them
+        max_bytes = settings.MAX_FILE_SIZE_KB * 1024
         
         for root, dirs, files in os.walk(repo_path):
             # Skip hidden directories like .git
             dirs[:] = [d for d in dirs if not d.startswith('.')]
             
             for file in files:
-                if any(file.endswith(ext) for ext in valid_extensions):
+                if os.path.splitext(file)[1] in CODE_EXTENSIONS:
                     full_path = os.path.join(root, file)
+                    try:
+                        if os.path.getsize(full_path) > max_bytes:
+                            continue
+                    except OSError:
+                        continue
                     relevant_files.append(full_path)
                     
         return relevant_files
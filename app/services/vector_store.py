@@ -1,12 +1,30 @@
 import chromadb
 from chromadb.utils import embedding_functions
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterator
 import os
 import ast
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from app.config import get_settings
 
 settings = get_settings()
 
+def _iter_definitions(statements: List[ast.stmt]) -> Iterator[ast.stmt]:
+    """
+    Yields every function and class definition in a list of statements, at any nesting depth.
+    Only statement bodies are descended into (definitions can't occur inside expressions),
+    which is much less than the full node set ast.walk would visit.
+    """
+    for node in statements:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            yield node
+        for field in ('body', 'orelse', 'finalbody'):
+            yield from _iter_definitions(getattr(node, field, []))
+        for handler in getattr(node, 'handlers', []):
+            yield from _iter_definitions(handler.body)
+        for case in getattr(node, 'cases', []):
+            yield from _iter_definitions(case.body)
+
 class VectorStore:
     def __init__(self):
         self.client = chromadb.PersistentClient(path=settings.CHROMA_DB_DIR)
@@ -33,30 +51,36 @@ class VectorStore:
         """
         Chunks Python code by functions and classes using AST.
         """
+        # Cheap literal prefilter: without these keywords there is nothing to chunk by,
+        # so skip the parse and go straight to the fallback
+        if 'def' not in content and 'class' not in content:
+            return self._chunk_sliding_window(file_path, content)
+
         chunks = []
         try:
-            tree = ast.parse(content)
+            tree = ast.parse(content, filename=file_path)
             lines = content.splitlines()
             
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                    # Get the source code segment
-                    start_line = node.lineno - 1
-                    end_line = node.end_lineno
-                    chunk_text = "\n".join(lines[start_line:end_line])
-                    
-                    # Add context (parents) if needed, but for now just the node
-                    chunks.append({
-                        "text": chunk_text,
-                        "metadata": {
-                            "file_path": file_path,
-                            "start_line": start_line + 1,
-                            "end_line": end_line,
-                            "type": "function" if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else "class",
-                            "name": node.name
-                        }
-                    })
-            
+            # Every function and class, nested ones included, so each function node in the
+            # dependency graph has a chunk to fetch by name
+            for node in _iter_definitions(tree.body):
+                # Get the source code segment
+                start_line = node.lineno - 1
+                end_line = node.end_lineno
+                chunk_text = "\n".join(lines[start_line:end_line])
+                
+                # Add context (parents) if needed, but for now just the node
+                chunks.append({
+                    "text": chunk_text,
+                    "metadata": {
+                        "file_path": file_path,
+                        "start_line": start_line + 1,
+                        "end_line": end_line,
+                        "type": "function" if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else "class",
+                        "name": node.name
+                    }
+                })
+        
             # If no functions/classes found, fallback to sliding window or just take whole file if small
             if not chunks:
                 return self._chunk_sliding_window(file_path, content)
@@ -110,53 +134,76 @@ class VectorStore:
             
         return chunks
 
-    def get_function_chunk(self, file_path: str, function_name: str) -> str:
+    def get_function_chunks(self, targets: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
         """
-        Retrieves the code chunk for a specific function.
+        Retrieves the code chunks for several functions with a single query.
+        Returns a mapping of (file_path, function_name) -> code.
         """
+        wanted = set(targets)
+        if not wanted:
+            return {}
+
         results = self.collection.get(
             where={
                 "$and": [
-                    {"file_path": file_path},
-                    {"name": function_name},
+                    {"file_path": {"$in": list({fp for fp, _ in wanted})}},
+                    {"name": {"$in": list({name for _, name in wanted})}},
                     {"type": "function"}
                 ]
             }
         )
-        
-        if results and results['documents']:
-            return results['documents'][0]
-        return ""
+
+        chunks = {}
+        # The filter is a cross product of paths and names, so keep only the requested pairs
+        for doc, metadata in zip(results.get('documents') or [], results.get('metadatas') or []):
+            key = (metadata.get('file_path'), metadata.get('name'))
+            if key in wanted and key not in chunks:
+                chunks[key] = doc
+        return chunks
+
+    def _read_and_chunk(self, file_path: str) -> List[Dict]:
+        """Reads a single file and chunks it. Returns no chunks if the file can't be processed."""
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+            return self.chunk_file(file_path, content)
+        except Exception as e:
+            print(f"Error processing file {file_path}: {e}")
+            return []
 
     def ingest_files(self, file_paths: List[str]):
         """Reads files, chunks them, and stores in ChromaDB."""
         ids = []
         documents = []
         metadatas = []
+        chunked_paths = []
         
-        for file_path in file_paths:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                
-                chunks = self.chunk_file(file_path, content)
-                
+        # Read and chunk files concurrently so disk I/O overlaps; map() keeps the input order
+        with ThreadPoolExecutor() as pool:
+            for file_path, chunks in zip(file_paths, pool.map(self._read_and_chunk, file_paths)):
+                # A file that couldn't be read yields no chunks; its stored chunks are left as they are
+                if chunks:
+                    chunked_paths.append(file_path)
                 for i, chunk in enumerate(chunks):
                     chunk_id = f"{file_path}_{i}"
                     ids.append(chunk_id)
                     documents.append(chunk['text'])
                     metadatas.append(chunk['metadata'])
-                    
-            except Exception as e:
-                print(f"Error processing file {file_path}: {e}")
-                continue
         
-        if ids:
-            # Upsert in batches if needed, but Chroma handles reasonable sizes
+        # Drop previously stored chunks of the re-chunked files first. Chunk ids are positional, so a file that
+        # now yields fewer chunks would otherwise keep stale trailing chunks from an older version.
+        batch_size = settings.BATCH_SIZE
+        for start in range(0, len(chunked_paths), batch_size):
+            self.collection.delete(where={"file_path": {"$in": chunked_paths[start:start + batch_size]}})
+        
+        # Upsert in batches: Chroma rejects writes above its max batch size, and each batch
+        # is embedded in one go, so this also bounds peak memory on large repositories
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
             self.collection.upsert(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end]
             )
 
     def query(self, query_text: str, n_results: int = 5):
@@ -164,3 +211,11 @@ class VectorStore:
             query_texts=[query_text],
             n_results=n_results
         )
+
+@lru_cache()
+def get_vector_store() -> VectorStore:
+    """
+    Returns a process-wide VectorStore.
+    The Chroma client and the embedding model are loaded once and reused across requests.
+    """
+    return VectorStore()
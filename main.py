@@ -1,18 +1,19 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List
 from app.config import get_settings
-from app.services.repo_manager import RepoManager
-from app.services.vector_store import VectorStore
+from app.services.repo_manager import RepoManager, get_artifacts_dir
+from app.services.vector_store import get_vector_store
 from app.services.analyzer import DependencyAnalyzer
+from app.services.llm_cache import get_llm_cache
+import asyncio
+import networkx as nx
 import os
 
-app = FastAPI(title="Code Fire Preventer")
+app = FastAPI(title="Code Fire Preventer", default_response_class=ORJSONResponse)
 settings = get_settings()
 
-# Global state for demo purposes (in production, use a proper DB)
-analysis_results: Dict[str, Any] = {}
-
 class AnalyzeRequest(BaseModel):
     repo_url: str
 
@@ -44,11 +45,12 @@ async def analyze_repo(request: AnalyzeRequest, background_tasks: BackgroundTask
             raise HTTPException(status_code=400, detail="No relevant code files found in the repository.")
             
         # 3. Ingest into Vector DB (Background task or sync? Let's do sync for now to ensure it's ready)
-        vector_store = VectorStore()
-        vector_store.ingest_files(files)
+        # Run the blocking chunk + embed + upsert off the event loop so other requests keep being served
+        vector_store = get_vector_store()
+        await asyncio.to_thread(vector_store.ingest_files, files)
         
         # 4. Analyze Dependencies (This takes time, so we'll do it in background and store result)
-        background_tasks.add_task(run_analysis, repo_path, files)
+        background_tasks.add_task(run_analysis, request.repo_url, repo_path, files)
         
         return AnalyzeResponse(
             message="Analysis started. Check /dependencies later.",
@@ -59,33 +61,51 @@ async def analyze_repo(request: AnalyzeRequest, background_tasks: BackgroundTask
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def run_analysis(repo_path: str, files: List[str]):
+def run_analysis(repo_url: str, repo_path: str, files: List[str]):
+    # Plain def on purpose: BackgroundTasks runs sync callables in the threadpool,
+    # so the per-file reads and LLM calls below don't block the event loop.
     analyzer = DependencyAnalyzer()
-    file_analyses = []
+    sources = []
     
     for file_path in files:
         try:
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            analysis = analyzer.analyze_file_dependencies(file_path, content)
-            file_analyses.append(analysis)
+                sources.append((file_path, f.read()))
         except Exception as e:
-            print(f"Failed to analyze {file_path}: {e}")
-            
-    graph_data = analyzer.build_dependency_graph(file_analyses)
+            print(f"Failed to read {file_path}: {e}")
     
-    # Store result keyed by repo path (simplified)
-    analysis_results["latest"] = graph_data
+    # Derived artifacts go to the server-owned artifacts directory, never into the clone,
+    # whose contents the repository controls
+    artifacts_dir = get_artifacts_dir(repo_url)
+    os.makedirs(artifacts_dir, exist_ok=True)
+    
+    # Python files are parsed locally; the rest are analyzed in a few batched LLM requests.
+    # Files unchanged since the previous run reuse their recorded analysis.
+    file_analyses = analyzer.analyze_files_incremental(sources, os.path.join(artifacts_dir, "dependency_analyses.json"))
+            
+    G = analyzer.build_dependency_digraph(file_analyses)
     
-    # Persist graph
+    # Persist graph (the endpoints read it back from disk, so no in-memory copy is kept).
+    # The JSON is served to clients; the pickle is what /analyze-impact loads.
     try:
-        graph_path = os.path.join(repo_path, "dependency_graph.json")
-        analyzer.save_graph(graph_data, graph_path)
+        graph_path = os.path.join(artifacts_dir, "dependency_graph.json")
+        pickle_path = os.path.join(artifacts_dir, "dependency_graph.pkl")
+        # Pickle first; if it can't be written, remove the previous run's so /analyze-impact
+        # falls back to the fresh JSON instead of preferring a stale pickle
+        try:
+            analyzer.save_graph_fast(G, pickle_path)
+        except Exception as e:
+            print(f"Failed to save graph pickle: {e}")
+            if os.path.exists(pickle_path):
+                os.remove(pickle_path)
+        analyzer.save_graph(nx.node_link_data(G), graph_path)
         print(f"Graph saved to {graph_path}")
     except Exception as e:
         print(f"Failed to save graph: {e}")
         
+    cache = get_llm_cache()
+    if cache:
+        print(cache.stats())
     print("Analysis complete.")
 
 from app.services.github_service import GitHubService
@@ -99,7 +119,7 @@ class ImpactRequest(BaseModel):
 async def analyze_impact(request: ImpactRequest):
     repo_manager = RepoManager()
     analyzer = DependencyAnalyzer()
-    vector_store = VectorStore()
+    vector_store = get_vector_store()
     github_service = GitHubService(token=request.github_token)
     
     try:
@@ -115,8 +135,11 @@ async def analyze_impact(request: ImpactRequest):
         # If the commit is very different, the graph might be stale. 
         # Ideally, we should rebuild the graph for the commit or assume the graph is "close enough".
         # For this MVP, we load the existing graph.
-        graph_path = os.path.join(repo_path, "dependency_graph.json")
-        graph_data = analyzer.load_graph(graph_path)
+        artifacts_dir = get_artifacts_dir(request.repo_url)
+        graph_data = analyzer.load_graph_fast(os.path.join(artifacts_dir, "dependency_graph.pkl"))
+        if graph_data is None:
+            # No pickle if it couldn't be written during analysis; the JSON is always there
+            graph_data = analyzer.load_graph(os.path.join(artifacts_dir, "dependency_graph.json"))
         
         if not graph_data:
             # Fallback: Run analysis if graph doesn't exist (might take time)
@@ -125,6 +148,9 @@ async def analyze_impact(request: ImpactRequest):
             
         # 4. Analyze Impact
         report = analyzer.analyze_impact(diff_data, graph_data, vector_store, repo_path)
+        cache = get_llm_cache()
+        if cache:
+            print(cache.stats())
         
         return report
         
@@ -137,15 +163,7 @@ def get_dependencies(repo_url: str):
     Retrieves the dependency graph for a given repository.
     """
     try:
-        # Reconstruct repo path (logic matches RepoManager)
-        repo_name = repo_url.split('/')[-1]
-        if repo_name.endswith('.git'):
-            repo_name = repo_name[:-4]
-            
-        project_root = os.getcwd()
-        repos_dir = os.path.join(project_root, "repos")
-        repo_path = os.path.join(repos_dir, repo_name)
-        graph_path = os.path.join(repo_path, "dependency_graph.json")
+        graph_path = os.path.join(get_artifacts_dir(repo_url), "dependency_graph.json")
         
         if not os.path.exists(graph_path):
             return {"status": "error", "message": "Dependency graph not found. Please run /analyze first."}